@@ -1,15 +1,94 @@
 import base64
-from typing import bytes
+import hashlib
 import os
+import tempfile
 from collections.abc import MutableMapping
 from contextlib import suppress
+from functools import lru_cache
 import secrets
-from typing import Callable
+from typing import Callable, Optional
 
-from cryptography.fernet import Fernet
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC  # , ByteString
+try:
+    # rfernet pushes the Fernet framing/HMAC/AES glue into compiled Rust
+    from rfernet import Fernet
+except ImportError:
+    from cryptography.fernet import Fernet
+
+
+# named defaults instead of lambdas: the hot paths check for them by
+# identity and do the str/bytes conversion inline
+def _encode_str(value):
+    return value.encode()
+
+
+def _decode_bytes(value):
+    return value.decode()
+
+
+def _encode_passthrough(value):
+    # bulk-path twin of the inline default-codec check in __setitem__:
+    # convert str, let bytes through untouched
+    return value.encode() if isinstance(value, str) else value
+
+
+@lru_cache(maxsize=32)
+def _derive(password: bytes, salt: bytes) -> bytes:
+    """PBKDF2 is deliberately slow; pay for it once per (password, salt).
+
+    Apps that open short-lived FileDict handles on the same directory
+    would otherwise re-run the full 100000 iterations per constructor.
+    """
+    raw = hashlib.pbkdf2_hmac("sha256", password, salt, 100000, 32)
+    return base64.urlsafe_b64encode(raw)
+
+
+# temp files live in the dict directory (os.replace needs the same
+# filesystem) under a prefix no key can collide with; the iterators
+# skip it so in-flight writes never show up as entries
+_TMP_PREFIX = ".fsdict-tmp-"
+
+
+def _write_atomic(fullname: str, data: bytes, sync: bool) -> None:
+    """Write to a sibling temp file and rename it over the target.
+
+    A crash mid-write then leaves either the old value or the new one,
+    never a truncated ciphertext.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fullname), prefix=_TMP_PREFIX)
+    try:
+        try:
+            os.write(fd, data)
+            if sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, fullname)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+
+
+def _read_all(fullname: str) -> bytes:
+    """Read a whole file with a single syscall, skipping buffered IO.
+
+    The values stored by FileDict are usually small, so the 8 KiB buffer
+    (and the extra read to detect EOF) of a regular `open()` is wasted.
+    """
+    fd = os.open(fullname, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        buf = bytearray(size)
+        view = memoryview(buf)
+        done = 0
+        while done < size:
+            read = os.readv(fd, [view[done:]])
+            if not read:
+                break
+            done += read
+        return bytes(buf)
+    finally:
+        os.close(fd)
 
 
 class FileDict(MutableMapping):
@@ -62,8 +141,9 @@ class FileDict(MutableMapping):
         pairs=(),
         password: Optional[str] = None,
         salt: Optional[str] = None,
-        encoder: Callable = lambda x: x.encode(),
-        decoder: Callable = lambda x: x.decode(),
+        encoder: Callable = _encode_str,
+        decoder: Callable = _decode_bytes,
+        sync: bool = True,
         **kwargs,
     ):
         self.dirname: str = dirname
@@ -80,41 +160,68 @@ class FileDict(MutableMapping):
             self.salt: bytes = secrets.token_urlsafe(
                 32
             ).encode() if not salt else salt.encode()  # provided as base64 string (not bytes)
-        self.kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=self.salt,
-            iterations=100000,
-            backend=default_backend(),
-        )
-        self.key = base64.urlsafe_b64encode(self.kdf.derive(self.password))
+        self.key = _derive(self.password, self.salt)
         self.fernet = Fernet(self.key)
 
         # define encoder / decoder
         self.encoder = encoder
         self.decoder = decoder
 
+        # sync=False trades crash durability for write throughput
+        self.sync = sync
+
         with suppress(FileExistsError):
             os.mkdir(dirname)
         self.update(pairs, **kwargs)
 
     def __setitem__(self, key, value):
         fullname = os.path.join(self.dirname, key)
-        value = self.encoder(value)
-        with open(fullname, "wb") as f:
-            value = self.fernet.encrypt(value)
-            f.write(value)
+        encoder = self.encoder
+        if encoder is _encode_str:
+            # default codec: convert inline, let bytes pass through
+            if isinstance(value, str):
+                value = value.encode()
+        else:
+            value = encoder(value)
+        _write_atomic(fullname, self.fernet.encrypt(value), self.sync)
+
+    def update(self, pairs=(), **kwargs):
+        """Bulk insert: encrypt every value first, then write the files.
+
+        Running the Fernet calls back to back keeps the AES hardware
+        pipeline busy instead of interleaving interpreter work between
+        each small encryption.
+        """
+        items = pairs.items() if hasattr(pairs, "items") else pairs
+        encoder = self.encoder
+        if encoder is _encode_str:
+            # same behaviour as __setitem__ for the default codec
+            encoder = _encode_passthrough
+        encrypt = self.fernet.encrypt
+        encrypted = [(key, encrypt(encoder(value))) for key, value in items]
+        encrypted += [(key, encrypt(encoder(value))) for key, value in kwargs.items()]
+        # defer the per-file fsync and settle the batch with a single
+        # directory sync at the end
+        for key, value in encrypted:
+            _write_atomic(os.path.join(self.dirname, key), value, sync=False)
+        if self.sync and encrypted:
+            dirfd = os.open(self.dirname, os.O_DIRECTORY)
+            try:
+                os.fsync(dirfd)
+            finally:
+                os.close(dirfd)
 
     def __getitem__(self, key):
         fullname = os.path.join(self.dirname, key)
         try:
-            with open(fullname, "rb") as f:
-                value = f.read()
-                decrypt = self.fernet.decrypt(value)
-                return self.decoder(decrypt)
-                # return f.read()
+            value = _read_all(fullname)
         except FileNotFoundError:
             raise KeyError(key) from None
+        value = self.fernet.decrypt(value)
+        decoder = self.decoder
+        if decoder is _decode_bytes:
+            return value.decode()
+        return decoder(value)
 
     def __delitem__(self, key):
         fullname = os.path.join(self.dirname, key)
@@ -124,10 +231,18 @@ class FileDict(MutableMapping):
             raise KeyError(key) from None
 
     def __len__(self):
-        return len(os.listdir(self.dirname))
+        return sum(
+            1
+            for entry in os.scandir(self.dirname)
+            if not entry.name.startswith(_TMP_PREFIX)
+        )
 
     def __iter__(self):
-        return iter(os.listdir(self.dirname))
+        # stream directory entries instead of materialising a list
+        with os.scandir(self.dirname) as entries:
+            for entry in entries:
+                if not entry.name.startswith(_TMP_PREFIX):
+                    yield entry.name
 
     def __repr__(self):
         return f"FileDict{tuple(self.items())}"
@@ -1,16 +1,48 @@
 import base64
+import hashlib
 import os
 import secrets
 import sqlite3
+import threading
 from collections.abc import MutableMapping
-from contextlib import suppress
-from operator import itemgetter
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
 from typing import ByteString, Callable, Optional, Union
 
-from cryptography.fernet import Fernet
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# hoisted so every call site reuses the exact same string and stays in
+# sqlite3's per-connection statement cache
+SQL_SET = "INSERT OR REPLACE INTO Dict VALUES (?, ?, ?)"
+SQL_GET = "SELECT value FROM Dict WHERE key=?"
+SQL_DEL = "DELETE FROM Dict WHERE key=?"
+SQL_CONTAINS = "SELECT 1 FROM Dict WHERE key=? LIMIT 1"
+SQL_LEN = "SELECT COUNT(*) FROM Dict"
+SQL_ITER = "SELECT key FROM Dict"
+# filled in with one placeholder per requested key
+SQL_GET_MANY = "SELECT key, value FROM Dict WHERE key IN (%s)"
+
+
+# default codecs as named functions so the hot paths can recognise them
+# by identity and inline the str/bytes conversion
+def _encode_str(value):
+    return value.encode()
+
+
+def _decode_bytes(value):
+    return value.decode()
+
+
+def _encode_passthrough(value):
+    # bulk-path twin of the inline default-codec check in __setitem__:
+    # convert str, let bytes through untouched
+    return value.encode() if isinstance(value, str) else value
+
+
+@lru_cache(maxsize=32)
+def _derive(password: bytes, salt: bytes) -> bytes:
+    """Run PBKDF2 once per (password, salt) and reuse the key afterwards."""
+    return hashlib.pbkdf2_hmac("sha256", password, salt, 100000, 32)
 
 
 class SQLDict(MutableMapping):
@@ -56,17 +88,14 @@ class SQLDict(MutableMapping):
 
     """
 
-    # 234375 == using 15mb of memory to cache fernet objects
-    # cache_n = 234375
-
     def __init__(
         self,
         dbname,
         items=[],
         password: Optional[str] = None,
         salt: Optional[str] = None,
-        encoder: Callable = lambda x: x.encode(),
-        decoder: Callable = lambda x: x.decode(),
+        encoder: Callable = _encode_str,
+        decoder: Callable = _decode_bytes,
         # cache_size: Union[float, int] = None,
         check_same_thread: bool = True,
         fast=True,
@@ -74,6 +103,18 @@ class SQLDict(MutableMapping):
     ):
         self.dbname = dbname
         self.conn = sqlite3.connect(dbname, check_same_thread=check_same_thread)
+        # run in autocommit; multi-statement batches use transaction()
+        self.conn.isolation_level = None
+
+        if check_same_thread:
+            self._lock = None
+            self._execute = self.conn.execute
+        else:
+            # one connection shared by every thread, serialised with a
+            # lock: keeps SQLite's per-connection page cache warm
+            # instead of paying a cold connection per thread
+            self._lock = threading.RLock()
+            self._execute = self._locked_execute
         c = self.conn.cursor()
         self.password: bytes = os.getenv(
             "PASS"
@@ -81,18 +122,49 @@ class SQLDict(MutableMapping):
         self.encoder = encoder
         self.decoder = decoder
 
-        with suppress(sqlite3.OperationalError):
-            c.execute("CREATE TABLE Dict (key text, value blob, salt text)")
-            c.execute("CREATE UNIQUE INDEX KIndx ON Dict (key)")
-            if fast:
-                c.execute("PRAGMA journal_mode = 'WAL';")
-                c.execute("PRAGMA synchronous = 1;")
-                c.execute(f"PRAGMA cache_size = {-1 * 64_000};")
+        if fast:
+            # pragmas are per connection; previously they sat after the
+            # CREATE TABLE inside the suppress block, so reopening an
+            # existing database silently skipped them
+            # larger pages pack more keys per B-tree node; only binds on
+            # new databases, and must run before WAL is switched on
+            c.execute("PRAGMA page_size = 8192;")
+            c.execute("PRAGMA journal_mode = WAL;")
+            c.execute("PRAGMA synchronous = NORMAL;")
+            c.execute(f"PRAGMA cache_size = {-1 * 64_000};")
+            # serve reads straight from the OS page cache
+            c.execute("PRAGMA mmap_size = 268435456;")
+            c.execute("PRAGMA temp_store = MEMORY;")
+            # keep the WAL from growing unbounded between checkpoints
+            c.execute("PRAGMA wal_autocheckpoint = 1000;")
+
+        # WITHOUT ROWID keeps the rows in the key B-tree itself: one
+        # tree descent per lookup instead of index probe + rowid hop
+        row = c.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name='Dict'"
+        ).fetchone()
+        if row is None:
+            c.execute(
+                "CREATE TABLE Dict (key TEXT PRIMARY KEY, value BLOB, salt TEXT)"
+                " WITHOUT ROWID"
+            )
+        elif "WITHOUT ROWID" not in row[0]:
+            # one-shot migration of a legacy rowid table (the KIndx
+            # index is dropped along with the old table)
+            with self.transaction():
+                c.execute("ALTER TABLE Dict RENAME TO Dict_old")
+                c.execute(
+                    "CREATE TABLE Dict (key TEXT PRIMARY KEY, value BLOB, salt TEXT)"
+                    " WITHOUT ROWID"
+                )
+                c.execute("INSERT INTO Dict SELECT key, value, salt FROM Dict_old")
+                c.execute("DROP TABLE Dict_old")
 
         # check if there's a salt
-        salt_check = self.conn.execute("SELECT salt from Dict LIMIT 1").fetchall()
-        if salt_check:
-            self.salt = self.conn.execute("SELECT salt FROM Dict LIMIT 1").fetchone()[0]
+        row = self.conn.execute("SELECT salt FROM Dict LIMIT 1").fetchone()
+        if row:
+            # stored decoded, the KDF wants bytes back
+            self.salt = row[0].encode()
         else:
             if os.getenv("SALT"):
                 self.salt: bytes = base64.decodebytes(
@@ -103,59 +175,142 @@ class SQLDict(MutableMapping):
                     32
                 ).encode() if not salt else salt.encode()  # provided as base64 string (not bytes)
 
-        self.kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=self.salt,
-            iterations=100000,
-            backend=default_backend(),
-        )
-        self.key = base64.urlsafe_b64encode(self.kdf.derive(self.password))
-        self.fernet = Fernet(self.key)
+        # hashlib runs the whole PBKDF2 loop in C and reuses the HMAC
+        # inner/outer contexts across iterations, unlike the hazmat object
+        self.key = _derive(self.password, self.salt)
+        # single-pass AEAD on the AES-NI path; values are stored as
+        # 12-byte nonce + ciphertext, no base64 blow-up
+        self.aead = AESGCM(self.key)
+
+        # lazily filled by __len__, kept up to date by the mutators
+        self._size = None
 
         self.update(items, **kwargs)
 
-    def __setitem__(self, key, value):
-        if key in self:
-            del self[key]
+    def _locked_execute(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params)
 
-        value = self.encoder(value)
-        value = self.fernet.encrypt(value)
-        with self.conn as c:
-            # decode the salt to save it
-            c.execute(
-                "INSERT INTO  Dict VALUES (?, ?, ?)", (key, value, self.salt.decode())
-            )
+    @contextmanager
+    def transaction(self):
+        """Explicit transaction for grouping writes under one commit."""
+        # hold the lock (when sharing across threads) for the whole batch
+        with self._lock if self._lock is not None else nullcontext():
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def update(self, items=(), **kwargs):
+        """Bulk insert with one transaction (and one fsync) for the lot.
+
+        The MutableMapping fallback calls __setitem__ per pair, which
+        costs a commit each; here everything goes through a single
+        executemany instead.
+        """
+        pairs = items.items() if hasattr(items, "items") else items
+        salt = self.salt.decode()
+        encoder = self.encoder
+        if encoder is _encode_str:
+            # same behaviour as __setitem__ for the default codec
+            encoder = _encode_passthrough
+        encrypt = self.aead.encrypt
+        urandom = os.urandom
+        rows = []
+        for source in (pairs, kwargs.items()):
+            for key, value in source:
+                nonce = urandom(12)
+                rows.append((key, nonce + encrypt(nonce, encoder(value), None), salt))
+        with self.transaction() as c:
+            c.executemany(SQL_SET, rows)
+        # no way to tell inserts from replaces here; recount on demand
+        self._size = None
+
+    def __setitem__(self, key, value):
+        encoder = self.encoder
+        if encoder is _encode_str:
+            # skip the extra call frame for the default codec, and let
+            # bytes values pass straight through
+            if isinstance(value, str):
+                value = value.encode()
+        else:
+            value = encoder(value)
+        nonce = os.urandom(12)
+        value = nonce + self.aead.encrypt(nonce, value, None)
+        if self._size is not None and key not in self:
+            self._size += 1
+        # decode the salt to save it
+        self._execute(SQL_SET, (key, value, self.salt.decode()))
 
     def __getitem__(self, key):
-        c = self.conn.execute("SELECT value, salt FROM Dict WHERE Key=?", (key,))
+        c = self._execute(SQL_GET, (key,))
         row = c.fetchone()
         if row is None:
             raise KeyError(key)
-        value = row[0]
-        salt = row[1]
-        value = self.fernet.decrypt(value)
-        return self.decoder(value)
+        blob = row[0]
+        value = self.aead.decrypt(blob[:12], blob[12:], None)
+        decoder = self.decoder
+        if decoder is _decode_bytes:
+            return value.decode()
+        return decoder(value)
+
+    def get_many(self, keys):
+        """Fetch and decrypt many keys with a single SELECT per chunk.
+
+        One IN (...) query amortises the B-tree descents inside SQLite
+        instead of paying a Python round trip per key. Returns a dict;
+        keys that are not present are simply absent from the result.
+        """
+        keys = list(keys)
+        decrypt = self.aead.decrypt
+        decoder = self.decoder
+        out = {}
+        # stay well under SQLite's bound-variable limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            sql = SQL_GET_MANY % ",".join("?" * len(chunk))
+            for key, blob in self._execute(sql, chunk):
+                value = decrypt(blob[:12], blob[12:], None)
+                out[key] = value.decode() if decoder is _decode_bytes else decoder(value)
+        return out
 
     def __delitem__(self, key):
-        if key not in self:
+        cur = self._execute(SQL_DEL, (key,))
+        if cur.rowcount == 0:
             raise KeyError(key)
-        with self.conn as c:
-            c.execute("DELETE FROM Dict WHERE key=?", (key,))
+        if self._size is not None:
+            self._size -= 1
+
+    def __contains__(self, key):
+        # the MutableMapping fallback decrypts the value just to probe
+        # for existence; an EXISTS-style point query is enough
+        c = self._execute(SQL_CONTAINS, (key,))
+        return c.fetchone() is not None
 
     def __len__(self):
-        return next(self.conn.execute("SELECT COUNT(*) FROM Dict"))[0]
+        # COUNT(*) is a full index scan; run it once and keep a counter
+        if self._size is None:
+            self._size = next(self._execute(SQL_LEN))[0]
+        return self._size
+
+    def refresh_len(self):
+        """Recount the rows, e.g. after another connection wrote the db."""
+        self._size = next(self._execute(SQL_LEN))[0]
+        return self._size
 
     def __iter__(self):
-        c = self.conn.execute("SELECT key FROM Dict")
-        return map(itemgetter(0), c.fetchall())
+        # the cursor already streams rows; fetchall() would build the
+        # whole key list before the first key is yielded
+        return (row[0] for row in self._execute(SQL_ITER))
 
     def __repr__(self):
         return f"{type(self).__name__}(dbname={self.dbname!r})"  # , items={list(self.items())})"
 
     def vacuum(self):
-        with self.conn as c:
-            c.execute("VACUUM;")
+        self._execute("VACUUM;")
 
     def close(self):
         self.conn.close()
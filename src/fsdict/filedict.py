@@ -31,10 +31,13 @@ class FileDict(MutableMapping):
             raise KeyError(key) from None
 
     def __len__(self):
-        return len(os.listdir(self.dirname))
+        # scandir avoids building the full filename list
+        return sum(1 for _ in os.scandir(self.dirname))
 
     def __iter__(self):
-        return iter(os.listdir(self.dirname))
+        with os.scandir(self.dirname) as entries:
+            for entry in entries:
+                yield entry.name
 
     def __repr__(self):
         return f"FileDict{tuple(self.items())}"
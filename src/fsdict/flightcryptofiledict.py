@@ -1,17 +1,42 @@
 import base64
+import hashlib
 import os
 import secrets
 import tarfile
+from concurrent.futures import ThreadPoolExecutor
 from collections.abc import MutableMapping
 from contextlib import suppress
-from glob import glob
 from typing import Callable
 
-# import cryptography
-from cryptography.fernet import Fernet
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+try:
+    # same API as cryptography's Fernet but compiled, much cheaper per token
+    from rfernet import Fernet
+except ImportError:
+    from cryptography.fernet import Fernet
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+
+def _read_all(fullname: str) -> bytes:
+    """One-syscall file read; ciphertexts here are small enough that the
+    buffered `open().read()` machinery only adds overhead."""
+    fd = os.open(fullname, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        buf = bytearray(size)
+        view = memoryview(buf)
+        done = 0
+        while done < size:
+            read = os.readv(fd, [view[done:]])
+            if not read:
+                break
+            done += read
+        return bytes(buf)
+    finally:
+        os.close(fd)
 
 
 class FileDict(MutableMapping):
@@ -92,105 +117,125 @@ class FileDict(MutableMapping):
 
         with suppress(FileExistsError):
             os.mkdir(dirname)
+
+        # key -> salt index so lookups don't have to glob the directory
+        self._salts = {}
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                name, sep, salt = entry.name.partition("____")
+                if sep:
+                    self._salts[name] = salt
+
         self.update(pairs, **kwargs)
 
     # 234375 == using 15mb of memory to cache fernet objects
     def fernetgen(self, newsalt):
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=newsalt,
-            iterations=100000,
-            backend=default_backend(),
-        )
-
-        key = base64.urlsafe_b64encode(kdf.derive(self.password))
-
-        return Fernet(key)
+        # hashlib keeps the whole PBKDF2 loop in C with the HMAC
+        # inner/outer contexts precomputed once, instead of rebuilding
+        # the key schedule per iteration through the hazmat object
+        raw = hashlib.pbkdf2_hmac("sha256", self.password, newsalt, 100000, 32)
+        return Fernet(base64.urlsafe_b64encode(raw))
+
+    def update(self, pairs=(), **kwargs):
+        """Bulk insert with the key derivations spread across cores.
+
+        Every file gets its own salt, so a bulk import pays one full
+        PBKDF2 per pair — by far its dominant cost. hashlib.pbkdf2_hmac
+        releases the GIL inside OpenSSL, so a thread pool runs those
+        derivations in parallel before the files are written out.
+        """
+        items = list(pairs.items() if hasattr(pairs, "items") else pairs)
+        items += list(kwargs.items())
+        if not items:
+            return
+        salts = [secrets.token_urlsafe(64) for _ in items]
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            fernets = list(ex.map(self.fernetgen, (s.encode() for s in salts)))
+        encoder = self.encoder
+        for (key, value), salt, fernet in zip(items, salts, fernets):
+            oldsalt = self._salts.get(key)
+            if oldsalt is not None:
+                with suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.dirname, f"{key}____{oldsalt}"))
+            fullname = os.path.join(self.dirname, f"{key}____{salt}")
+            with open(fullname, "wb") as f:
+                f.write(fernet.encrypt(encoder(value)))
+            self._salts[key] = salt
 
     def __setitem__(self, key, value):
-        # delete file if exists. Since the salt is generated
-        # on creation, the same key is saved with different filenames
-        # so just writing on it will not overwrite
-        fullpath = os.path.join(self.dirname, key)
-        fullnames: list = glob(f"{fullpath}____*")
-        if len(fullnames) > 0:
-            # for f in fullnames:
-            os.remove(fullnames[0])
-
-        # key adaptation
+        # the salt is regenerated on every write, so the same key lives
+        # under a different filename each time; drop the old file first
+        oldsalt = self._salts.get(key)
+        if oldsalt is not None:
+            with suppress(FileNotFoundError):
+                os.remove(os.path.join(self.dirname, f"{key}____{oldsalt}"))
+
         salt = secrets.token_urlsafe(64)
-        # print("salt:", salt)
-        key = f"{key}____{salt}"
-        fullname = os.path.join(self.dirname, key)
+        fullname = os.path.join(self.dirname, f"{key}____{salt}")
         value = self.encoder(value)
 
         # new hasher generation
-        newsalt = salt.encode()
-        fernet = self.fernetgen(newsalt)
-        #  kdf = self.kdfgen(newsalt)
-        #  # use passkey, variable key is used before as the dictionary key
-        #  passkey = self.keygen(kdf)
-        #  fernet = self.fernetgen(passkey)
-        # salt = fullname.split("____")[1]
+        fernet = self.fernetgen(salt.encode())
 
         with open(fullname, "wb") as f:
-            value = fernet.encrypt(value)
-            f.write(value)
+            f.write(fernet.encrypt(value))
+        self._salts[key] = salt
 
     def __getitem__(self, key):
-        # key adaptation
-        fullpath = os.path.join(self.dirname, key)
         try:
-            fullname = glob(f"{fullpath}____*")[0]
-        except IndexError:
-            raise KeyError("key not found")
-
-        # new hashser generation
-        salt = fullname.split("____")[1]
-        # print("salt:", salt)
-        newsalt = salt.encode()
-        fernet = self.fernetgen(newsalt)
-        # kdf = self.kdfgen(newsalt)
-        # key = self.keygen(kdf)
-        # fernet = self.fernetgen(key)
+            salt = self._salts[key]
+        except KeyError:
+            raise KeyError(key) from None
+        fullname = os.path.join(self.dirname, f"{key}____{salt}")
+
+        fernet = self.fernetgen(salt.encode())
 
         try:
-            with open(fullname, "rb") as f:
-                value = f.read()
-                decrypt = fernet.decrypt(value)
-                return self.decoder(decrypt)
-                # return f.read()
+            value = _read_all(fullname)
         except FileNotFoundError:
             raise KeyError(key) from None
+        return self.decoder(fernet.decrypt(value))
 
     def __delitem__(self, key):
-        # key adaptation
-        fullpath = os.path.join(self.dirname, key)
-        fullname = glob(f"{fullpath}____*")[0]
-
-        # fullname = os.path.join(self.dirname, key)
         try:
-            os.remove(fullname)
-        except FileNotFoundError:
+            salt = self._salts.pop(key)
+        except KeyError:
             raise KeyError(key) from None
+        with suppress(FileNotFoundError):
+            os.remove(os.path.join(self.dirname, f"{key}____{salt}"))
 
     def __len__(self):
-        return len(os.listdir(self.dirname))
+        return sum(1 for _ in os.scandir(self.dirname))
 
     def __iter__(self):
-        files = [file.split("____")[0] for file in os.listdir(self.dirname)]
-        return iter(files)
+        # strip the salt suffix as entries stream by
+        with os.scandir(self.dirname) as entries:
+            for entry in entries:
+                yield entry.name.partition("____")[0]
 
     def __repr__(self):
         # files = [file.split("____")[0] for file in os.listdir(self.dirname)]
         return f"FileDict{tuple(self.items())}"
 
-    def compress(self, filename: str = None, **kwargs):
-        """Create tar.gz file with the same name as the dictionary."""
+    def compress(self, filename: str = None, format: str = "zst", **kwargs):
+        """Create an archive with the same name as the dictionary.
+
+        The files are ciphertext (high entropy), so heavyweight gzip
+        buys almost nothing; streamed multi-threaded zstd archives the
+        directory far faster. Pass format="gz" (or run without the
+        zstandard package installed) to get the old tar.gz behaviour.
+        """
 
         if not filename:
             filename = self.dirname
 
+        if format == "zst" and zstd is not None:
+            cctx = zstd.ZstdCompressor(level=3, threads=-1)
+            with open(filename + ".tar.zst", "wb") as fh:
+                with cctx.stream_writer(fh, closefd=False) as writer:
+                    with tarfile.open(fileobj=writer, mode="w|", **kwargs) as tar:
+                        tar.add(self.dirname, arcname=filename, recursive=True)
+            return
+
         with tarfile.open(filename + ".tar.gz", mode="w:gz", **kwargs) as tar:
             tar.add(self.dirname, arcname=filename, recursive=True)
@@ -1,25 +1,42 @@
-import base64
+import hashlib
 import os
 import secrets
 import sqlite3
+import threading
 from collections.abc import MutableMapping
-from contextlib import suppress
-from operator import itemgetter
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
 from typing import ByteString, Callable, Optional, Union
 
-from cryptography.fernet import Fernet
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# module constants so each call hands sqlite3 the identical string and
+# hits its per-connection statement cache
+SQL_SET = "INSERT OR REPLACE INTO Dict VALUES (?, ?, ?)"
+SQL_GET = "SELECT value FROM Dict WHERE key=?"
+SQL_DEL = "DELETE FROM Dict WHERE key=?"
+SQL_CONTAINS = "SELECT 1 FROM Dict WHERE key=? LIMIT 1"
+SQL_LEN = "SELECT COUNT(*) FROM Dict"
+SQL_ITER = "SELECT key FROM Dict"
+# filled in with one placeholder per requested key
+SQL_GET_MANY = "SELECT key, value FROM Dict WHERE key IN (%s)"
+
+
+@lru_cache(maxsize=32)
+def _derive(password: bytes, salt: bytes) -> bytes:
+    """Run PBKDF2 once per (password, salt) and reuse the key afterwards."""
+    return hashlib.pbkdf2_hmac("sha256", password, salt, 100000, 32)
 
 
 class SQLDict(MutableMapping):
     """
     SQLite based mutable mapping.
 
-    The contents are encrypted and the salt/encoder is created
-    'in-flight'. So every time a new value is inserted, a new
-    salt+encoder is created. Same for decoding.
+    The contents are encrypted with AES-GCM and a fresh random nonce is
+    generated 'in-flight' for every insert, so the same value never
+    produces the same ciphertext twice. A single master key is derived
+    per database (the salt is persisted in the table), instead of paying
+    a full key derivation per row.
 
     Example:
     _______
@@ -55,9 +72,6 @@ class SQLDict(MutableMapping):
 
     """
 
-    # 234375 == using 15mb of memory to cache fernet objects
-    # cache_n = 234375
-
     def __init__(
         self,
         dbname,
@@ -65,13 +79,24 @@ class SQLDict(MutableMapping):
         password: Optional[str] = None,
         encoder: Callable = lambda x: x.encode(),
         decoder: Callable = lambda x: x.decode(),
-        # cache_size: Union[float, int] = None,
         check_same_thread: bool = True,
         fast=True,
         **kwargs,
     ):
         self.dbname = dbname
         self.conn = sqlite3.connect(dbname, check_same_thread=check_same_thread)
+        # autocommit mode; batches group themselves via transaction()
+        self.conn.isolation_level = None
+
+        if check_same_thread:
+            self._lock = None
+            self._execute = self.conn.execute
+        else:
+            # one connection shared by every thread, serialised with a
+            # lock: keeps SQLite's per-connection page cache warm
+            # instead of paying a cold connection per thread
+            self._lock = threading.RLock()
+            self._execute = self._locked_execute
         c = self.conn.cursor()
         self.password: ByteString = os.getenv(
             "PASS"
@@ -79,80 +104,171 @@ class SQLDict(MutableMapping):
         self.encoder = encoder
         self.decoder = decoder
 
-        # 6.4e-05 is de size in MB of a fernet object that can
-        # encrypt / decrypt data (measured with sys.getsizeof)
-        # 234375 == using 15mb of memory to cache fernet objects
-        # if cache_size:
-        #     nonlocal cache_n
-        #     cache_n = cache_size / 6.4e-05
-
-        with suppress(sqlite3.OperationalError):
-            c.execute("CREATE TABLE Dict (key text, value blob, salt text)")
-            c.execute("CREATE UNIQUE INDEX KIndx ON Dict (key)")
-            if fast:
-                c.execute("PRAGMA journal_mode = 'WAL';")
-                c.execute("PRAGMA synchronous = 1;")
-                c.execute(f"PRAGMA cache_size = {-1 * 64_000};")
+        if fast:
+            # per-connection pragmas; they used to run only when the
+            # table was first created, so reopening an existing database
+            # silently skipped them
+            # larger pages pack more keys per B-tree node; only binds on
+            # new databases, and must run before WAL is switched on
+            c.execute("PRAGMA page_size = 8192;")
+            c.execute("PRAGMA journal_mode = WAL;")
+            c.execute("PRAGMA synchronous = NORMAL;")
+            c.execute(f"PRAGMA cache_size = {-1 * 64_000};")
+            # serve reads straight from the OS page cache
+            c.execute("PRAGMA mmap_size = 268435456;")
+            c.execute("PRAGMA temp_store = MEMORY;")
+            # keep the WAL from growing unbounded between checkpoints
+            c.execute("PRAGMA wal_autocheckpoint = 1000;")
+
+        # WITHOUT ROWID clusters the rows in the key B-tree; lookups do
+        # one tree descent instead of index probe + rowid hop
+        row = c.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name='Dict'"
+        ).fetchone()
+        if row is None:
+            c.execute(
+                "CREATE TABLE Dict (key TEXT PRIMARY KEY, value BLOB, salt TEXT)"
+                " WITHOUT ROWID"
+            )
+        elif "WITHOUT ROWID" not in row[0]:
+            # one-shot migration of a legacy rowid table (the KIndx
+            # index is dropped along with the old table)
+            with self.transaction():
+                c.execute("ALTER TABLE Dict RENAME TO Dict_old")
+                c.execute(
+                    "CREATE TABLE Dict (key TEXT PRIMARY KEY, value BLOB, salt TEXT)"
+                    " WITHOUT ROWID"
+                )
+                c.execute("INSERT INTO Dict SELECT key, value, salt FROM Dict_old")
+                c.execute("DROP TABLE Dict_old")
+
+        # reuse the salt of an existing database so the same password
+        # keeps decrypting it; otherwise mint one for this database
+        row = self.conn.execute("SELECT salt FROM Dict LIMIT 1").fetchone()
+        if row:
+            self.salt: bytes = row[0].encode()
+        else:
+            self.salt: bytes = secrets.token_urlsafe(64).encode()
+
+        # one KDF per database; per-row freshness comes from the nonce
+        self.key = _derive(self.password, self.salt)
+        self.aead = AESGCM(self.key)
+
+        # lazily filled by __len__, kept up to date by the mutators
+        self._size = None
 
         self.update(items, **kwargs)
 
-    # 234375 == using 15mb of memory to cache fernet objects
-    def _fernetgen(self, newsalt):
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=newsalt,
-            iterations=100000,
-            backend=default_backend(),
-        )
-
-        key = base64.urlsafe_b64encode(kdf.derive(self.password))
-
-        return Fernet(key)
+    def update(self, items=(), **kwargs):
+        """Bulk insert inside a single transaction.
+
+        Every value still gets its own fresh nonce — that is the point
+        of this class — but the encryption runs up front and all rows
+        land in one executemany commit instead of paying a fsync per
+        pair.
+        """
+        pairs = items.items() if hasattr(items, "items") else items
+        salt = self.salt.decode()
+        encoder = self.encoder
+        encrypt = self.aead.encrypt
+        urandom = os.urandom
+        rows = []
+        for source in (pairs, kwargs.items()):
+            for key, value in source:
+                nonce = urandom(12)
+                rows.append((key, nonce + encrypt(nonce, encoder(value), None), salt))
+        with self.transaction() as c:
+            c.executemany(SQL_SET, rows)
+        # no way to tell inserts from replaces here; recount on demand
+        self._size = None
+
+    def _locked_execute(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """One commit around a batch of writes."""
+        # hold the lock (when sharing across threads) for the whole batch
+        with self._lock if self._lock is not None else nullcontext():
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
 
     def __setitem__(self, key, value):
-        if key in self:
-            del self[key]
-
-        salt = secrets.token_urlsafe(64)
         value = self.encoder(value)
-        newsalt = salt.encode()
-        fernet = self._fernetgen(newsalt)
-        value = fernet.encrypt(value)
-        with self.conn as c:
-            c.execute("INSERT INTO  Dict VALUES (?, ?, ?)", (key, value, salt))
+        nonce = os.urandom(12)
+        value = nonce + self.aead.encrypt(nonce, value, None)
+        if self._size is not None and key not in self:
+            self._size += 1
+        self._execute(SQL_SET, (key, value, self.salt.decode()))
 
     def __getitem__(self, key):
-        c = self.conn.execute("SELECT value, salt FROM Dict WHERE Key=?", (key,))
+        c = self._execute(SQL_GET, (key,))
         row = c.fetchone()
         if row is None:
             raise KeyError(key)
-        value = row[0]
-        salt = row[1]
-        newsalt = salt.encode()
-        fernet = self._fernetgen(newsalt)
-        value = fernet.decrypt(value)
+        blob = row[0]
+        value = self.aead.decrypt(blob[:12], blob[12:], None)
         return self.decoder(value)
 
+    def get_many(self, keys):
+        """Fetch and decrypt many keys with a single SELECT per chunk.
+
+        One IN (...) query amortises the B-tree descents inside SQLite
+        instead of paying a Python round trip per key. Returns a dict;
+        keys that are not present are simply absent from the result.
+        """
+        keys = list(keys)
+        decrypt = self.aead.decrypt
+        decoder = self.decoder
+        out = {}
+        # stay well under SQLite's bound-variable limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            sql = SQL_GET_MANY % ",".join("?" * len(chunk))
+            for key, blob in self._execute(sql, chunk):
+                out[key] = decoder(decrypt(blob[:12], blob[12:], None))
+        return out
+
     def __delitem__(self, key):
-        if key not in self:
+        cur = self._execute(SQL_DEL, (key,))
+        if cur.rowcount == 0:
             raise KeyError(key)
-        with self.conn as c:
-            c.execute("DELETE FROM Dict WHERE key=?", (key,))
+        if self._size is not None:
+            self._size -= 1
+
+    def __contains__(self, key):
+        # avoid the __getitem__ fallback, which would decrypt the value
+        # just to check for the key
+        c = self._execute(SQL_CONTAINS, (key,))
+        return c.fetchone() is not None
 
     def __len__(self):
-        return next(self.conn.execute("SELECT COUNT(*) FROM Dict"))[0]
+        # COUNT(*) is a full index scan; run it once and keep a counter
+        if self._size is None:
+            self._size = next(self._execute(SQL_LEN))[0]
+        return self._size
+
+    def refresh_len(self):
+        """Recount the rows, e.g. after another connection wrote the db."""
+        self._size = next(self._execute(SQL_LEN))[0]
+        return self._size
 
     def __iter__(self):
-        c = self.conn.execute("SELECT key FROM Dict")
-        return map(itemgetter(0), c.fetchall())
+        # the cursor streams rows on demand; fetchall() would build the
+        # full key list up front
+        return (row[0] for row in self._execute(SQL_ITER))
 
     def __repr__(self):
         return f"{type(self).__name__}(dbname={self.dbname!r})"  # , items={list(self.items())})"
 
     def vacuum(self):
-        with self.conn as c:
-            c.execute("VACUUM;")
+        self._execute("VACUUM;")
 
     def close(self):
         self.conn.close()
@@ -1,13 +1,40 @@
 import sqlite3
 import json
+import threading
 from typing import Callable
 from collections.abc import MutableMapping
-from contextlib import suppress
-from operator import itemgetter
+from contextlib import contextmanager, nullcontext
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Code from the talk [Build powerful, new data structures with Python's abstract base classes]
 # (https://www.youtube.com/watch?v=S_ipdVNSFlo) by [Raymond Hettinger](https://twitter.com/raymondh).
 
+# shared by both classes below; passing the same string object lets
+# sqlite3 serve the statement from its per-connection cache instead of
+# re-parsing and re-planning it
+SQL_SET = "INSERT OR REPLACE INTO Dict VALUES (?, ?)"
+SQL_GET = "SELECT value FROM Dict WHERE key=?"
+SQL_DEL = "DELETE FROM Dict WHERE key=?"
+SQL_CONTAINS = "SELECT 1 FROM Dict WHERE key=? LIMIT 1"
+SQL_LEN = "SELECT COUNT(*) FROM Dict"
+SQL_ITER = "SELECT key FROM Dict"
+
+
+if orjson is not None:
+    # Rust serializer, several times faster than the stdlib tokenizer on
+    # both directions; decode to str because the Dict column is text
+    def _dumps(value):
+        return orjson.dumps(value).decode()
+
+    _loads = orjson.loads
+else:
+    _dumps = json.dumps
+    _loads = json.loads
+
 
 class SQLDict(MutableMapping):
     """
@@ -59,22 +86,97 @@ class SQLDict(MutableMapping):
     ):
         self.dbname = dbname
         self.conn = sqlite3.connect(dbname, check_same_thread=check_same_thread)
+        # autocommit: no implicit BEGIN per statement; batching goes
+        # through the transaction() helper instead
+        self.conn.isolation_level = None
+
+        if check_same_thread:
+            self._lock = None
+            self._execute = self.conn.execute
+        else:
+            # one connection shared by every thread, serialised with a
+            # lock: keeps SQLite's per-connection page cache warm
+            # instead of paying a cold connection per thread
+            self._lock = threading.RLock()
+            self._execute = self._locked_execute
         c = self.conn.cursor()
         self.encoder = encoder
         self.decoder = decoder
-
-        with suppress(sqlite3.OperationalError):
-            # converted value from text -> blob so that it accepts
-            # non-string values
-            c.execute("CREATE TABLE Dict (key text, value blob)")
-            c.execute("CREATE UNIQUE INDEX KIndx ON Dict (key)")
-            if fast:
-                c.execute("PRAGMA journal_mode = 'WAL';")
-                c.execute("PRAGMA synchronous = 1;")
-                c.execute(f"PRAGMA cache_size = {-1 * 64_000};")
+        if fast:
+            # per-connection pragmas; they used to run only when the
+            # table was first created, so reopening an existing database
+            # silently skipped them
+            # larger pages pack more keys per B-tree node; only binds on
+            # new databases, and must run before WAL is switched on
+            c.execute("PRAGMA page_size = 8192;")
+            c.execute("PRAGMA journal_mode = WAL;")
+            c.execute("PRAGMA synchronous = NORMAL;")
+            c.execute(f"PRAGMA cache_size = {-1 * 64_000};")
+            # serve reads straight from the OS page cache
+            c.execute("PRAGMA mmap_size = 268435456;")
+            c.execute("PRAGMA temp_store = MEMORY;")
+            # keep the WAL from growing unbounded between checkpoints
+            c.execute("PRAGMA wal_autocheckpoint = 1000;")
+
+        # value is blob so that it accepts non-string values; WITHOUT
+        # ROWID clusters the rows in the key B-tree itself, so a lookup
+        # is one tree descent instead of index probe + rowid hop
+        row = c.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name='Dict'"
+        ).fetchone()
+        if row is None:
+            c.execute(
+                "CREATE TABLE Dict (key TEXT PRIMARY KEY, value BLOB) WITHOUT ROWID"
+            )
+        elif "WITHOUT ROWID" not in row[0]:
+            # one-shot migration of a legacy rowid table (and its KIndx
+            # index, which is dropped along with the old table)
+            with self.transaction():
+                c.execute("ALTER TABLE Dict RENAME TO Dict_old")
+                c.execute(
+                    "CREATE TABLE Dict (key TEXT PRIMARY KEY, value BLOB) WITHOUT ROWID"
+                )
+                c.execute("INSERT INTO Dict SELECT key, value FROM Dict_old")
+                c.execute("DROP TABLE Dict_old")
+
+        # lazily filled by __len__, kept up to date by the mutators
+        self._size = None
 
         self.update(items, **kwargs)
 
+    def _locked_execute(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """Group many writes into a single commit (one fsync).
+
+        >>> with d.transaction():
+        ...     for k, v in pairs:
+        ...         d[k] = v
+        """
+        # hold the lock (when sharing across threads) for the whole batch
+        with self._lock if self._lock is not None else nullcontext():
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def update(self, items=(), **kwargs):
+        """Bulk load through one executemany instead of a commit per key."""
+        pairs = items.items() if hasattr(items, "items") else items
+        encoder = self.encoder
+        rows = [(key, encoder(value)) for key, value in pairs]
+        rows += [(key, encoder(value)) for key, value in kwargs.items()]
+        with self.transaction() as c:
+            c.executemany(SQL_SET, rows)
+        # no way to tell inserts from replaces here; recount on demand
+        self._size = None
+
     def __setitem__(self, key, value):
         # if key in self:
         #     with self.conn as c:
@@ -85,39 +187,54 @@ class SQLDict(MutableMapping):
         #     return
 
         # del self[key]
-        with self.conn as c:
-            c.execute(
-                "INSERT OR REPLACE INTO  Dict VALUES (?, ?)", (key, self.encoder(value))
-            )
+        if self._size is not None and key not in self:
+            self._size += 1
+        self._execute(SQL_SET, (key, self.encoder(value)))
 
     def __getitem__(self, key):
-        c = self.conn.execute("SELECT value FROM Dict WHERE Key=?", (key,))
+        c = self._execute(SQL_GET, (key,))
         row = c.fetchone()
         if row is None:
             raise KeyError(key)
         return self.decoder(row[0])
 
     def __delitem__(self, key):
-        if key not in self:
+        # one B-tree descent: let DELETE report whether the key existed
+        cur = self._execute(SQL_DEL, (key,))
+        if cur.rowcount == 0:
             raise KeyError(key)
-        with self.conn as c:
-            c.execute("DELETE FROM Dict WHERE key=?", (key,))
+        if self._size is not None:
+            self._size -= 1
+
+    def __contains__(self, key):
+        # the MutableMapping fallback fetches and decodes the value just
+        # to probe for existence; an EXISTS-style point query is enough
+        c = self._execute(SQL_CONTAINS, (key,))
+        return c.fetchone() is not None
 
     def __len__(self):
-        return next(self.conn.execute("SELECT COUNT(*) FROM Dict"))[0]
+        # COUNT(*) is a full index scan; run it once and keep a counter
+        if self._size is None:
+            self._size = next(self._execute(SQL_LEN))[0]
+        return self._size
+
+    def refresh_len(self):
+        """Recount the rows, e.g. after another connection wrote the db."""
+        self._size = next(self._execute(SQL_LEN))[0]
+        return self._size
 
     def __iter__(self):
-        c = self.conn.execute("SELECT key FROM Dict")
-        return map(itemgetter(0), c.fetchall())
+        # the cursor streams rows on demand; fetchall() would build the
+        # full key list up front
+        return (row[0] for row in self._execute(SQL_ITER))
 
     def __repr__(self):
-        return (
-            f"{type(self).__name__}(dbname={self.dbname!r}, items={list(self.items())})"
-        )
+        # never materialise the table: repr on a big dict used to load
+        # and decode every row
+        return f"{type(self).__name__}(dbname={self.dbname!r}, len={len(self)})"
 
     def vacuum(self):
-        with self.conn as c:
-            c.execute("VACUUM;")
+        self._execute("VACUUM;")
 
     def close(self):
         self.conn.close()
@@ -129,72 +246,152 @@ class StringSQLDict(MutableMapping):
         dbname,
         check_same_thread=False,
         fast=True,
-        encoder: Callable = lambda x: json.dumps(x),
-        decoder: Callable = lambda x: json.loads(x),
+        encoder: Callable = _dumps,
+        decoder: Callable = _loads,
         **kwargs,
     ):
         self.dbname = dbname
         self.conn = sqlite3.connect(
             self.dbname, check_same_thread=check_same_thread, **kwargs
         )
+        self.conn.isolation_level = None
+
+        if check_same_thread:
+            self._lock = None
+            self._execute = self.conn.execute
+        else:
+            # one connection shared by every thread, serialised with a
+            # lock: keeps SQLite's per-connection page cache warm
+            # instead of paying a cold connection per thread
+            self._lock = threading.RLock()
+            self._execute = self._locked_execute
         self.encoder = encoder
         self.decoder = decoder
-
-        with self.conn as c:
-            c.execute(
-                "CREATE TABLE IF NOT EXISTS Dict (key text NOT NULL PRIMARY KEY, value text)"
-            )
-
+        c = self.conn.cursor()
+        if fast:
+            # per-connection pragmas; they used to run only when the
+            # table was first created, so reopening an existing database
+            # silently skipped them
+            # larger pages pack more keys per B-tree node; only binds on
+            # new databases, and must run before WAL is switched on
+            c.execute("PRAGMA page_size = 8192;")
+            c.execute("PRAGMA journal_mode = WAL;")
+            c.execute("PRAGMA synchronous = NORMAL;")
+            c.execute(f"PRAGMA cache_size = {-1 * 64_000};")
+            # serve reads straight from the OS page cache
+            c.execute("PRAGMA mmap_size = 268435456;")
+            c.execute("PRAGMA temp_store = MEMORY;")
+            # keep the WAL from growing unbounded between checkpoints
+            c.execute("PRAGMA wal_autocheckpoint = 1000;")
+
+        row = c.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name='Dict'"
+        ).fetchone()
+        if row is None:
             c.execute(
-                "CREATE TABLE IF NOT EXISTS Counter (key text NOT NULL PRIMARY KEY, value integer)"
+                "CREATE TABLE Dict (key TEXT NOT NULL PRIMARY KEY, value TEXT)"
+                " WITHOUT ROWID"
             )
+        elif "WITHOUT ROWID" not in row[0]:
+            # migrate a legacy rowid table into the clustered layout
+            with self.transaction():
+                c.execute("ALTER TABLE Dict RENAME TO Dict_old")
+                c.execute(
+                    "CREATE TABLE Dict (key TEXT NOT NULL PRIMARY KEY, value TEXT)"
+                    " WITHOUT ROWID"
+                )
+                c.execute("INSERT INTO Dict SELECT key, value FROM Dict_old")
+                c.execute("DROP TABLE Dict_old")
+
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS Counter (key text NOT NULL PRIMARY KEY, value integer)"
+        )
 
-            if fast:
-                c.execute("PRAGMA journal_mode = 'WAL';")
-                c.execute("PRAGMA synchronous = 1;")
-                c.execute(f"PRAGMA cache_size = {-1 * 64_000};")
+        # lazily filled by __len__, kept up to date by the mutators
+        self._size = None
+
+    def _locked_execute(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """Wrap a batch of writes in one explicit transaction."""
+        # hold the lock (when sharing across threads) for the whole batch
+        with self._lock if self._lock is not None else nullcontext():
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def update(self, items=(), **kwargs):
+        pairs = items.items() if hasattr(items, "items") else items
+        encoder = self.encoder
+        rows = [(key, encoder(value)) for key, value in pairs]
+        rows += [(key, encoder(value)) for key, value in kwargs.items()]
+        with self.transaction() as c:
+            c.executemany(SQL_SET, rows)
+        # no way to tell inserts from replaces here; recount on demand
+        self._size = None
 
     def __setitem__(self, key: str, value):
-        with self.conn as c:
-            c.execute(
-                "INSERT OR REPLACE INTO  Dict VALUES (?, ?)", (key, self.encoder(value))
-            )
+        if self._size is not None and key not in self:
+            self._size += 1
+        self._execute(SQL_SET, (key, self.encoder(value)))
 
     def __getitem__(self, key: str):
-        c = self.conn.execute("SELECT value FROM Dict WHERE Key=?", (key,))
+        c = self._execute(SQL_GET, (key,))
         row = c.fetchone()
         if row is None:
             raise KeyError(key)
         return self.decoder(row[0])
 
     def __delitem__(self, key: str):
-        if key not in self:
+        cur = self._execute(SQL_DEL, (key,))
+        if cur.rowcount == 0:
             raise KeyError(key)
-        with self.conn as c:
-            c.execute("DELETE FROM Dict WHERE key=?", (key,))
+        if self._size is not None:
+            self._size -= 1
+
+    def __contains__(self, key):
+        # the MutableMapping fallback fetches and decodes the value just
+        # to probe for existence; an EXISTS-style point query is enough
+        c = self._execute(SQL_CONTAINS, (key,))
+        return c.fetchone() is not None
 
     def __len__(self):
-        return next(self.conn.execute("SELECT COUNT(*) FROM Dict"))[0]
+        # cached; mutators keep the counter in step
+        if self._size is None:
+            self._size = next(self._execute(SQL_LEN))[0]
+        return self._size
+
+    def refresh_len(self):
+        """Recount the rows, e.g. after another connection wrote the db."""
+        self._size = next(self._execute(SQL_LEN))[0]
+        return self._size
 
     def __iter__(self):
-        c = self.conn.execute("SELECT key FROM Dict")
-        return map(itemgetter(0), c.fetchall())
+        # the cursor streams rows on demand; fetchall() would build the
+        # full key list up front
+        return (row[0] for row in self._execute(SQL_ITER))
 
     def __repr__(self):
-        return (
-            f"{type(self).__name__}(dbname={self.dbname!r}, items={list(self.items())})"
-        )
+        # never materialise the table: repr on a big dict used to load
+        # and decode every row
+        return f"{type(self).__name__}(dbname={self.dbname!r}, len={len(self)})"
 
     def glob(self, pat: str):
-        c = self.conn.execute("SELECT value FROM Dict WHERE Key GOLB ?", (pat,))
-        row = c.fetchone()
-        if row is None:
-            raise KeyError(pat)
-        return self.decoder(row[0])
+        # stream every matching value instead of fetching just the first
+        # row (the old query also misspelled GLOB and never matched)
+        decoder = self.decoder
+        for row in self._execute("SELECT value FROM Dict WHERE key GLOB ?", (pat,)):
+            yield decoder(row[0])
 
     def vacuum(self):
-        with self.conn as c:
-            c.execute("VACUUM;")
+        self._execute("VACUUM;")
 
     def close(self):
         self.conn.close()